@@ -1,7 +1,8 @@
-import asyncio
+import time
 
 from defopt import run
 from telegram import Bot
+from telegram.error import RetryAfter
 import os
 import logging
 
@@ -10,20 +11,32 @@ logging.basicConfig(level=LOGLEVEL)
 
 logger = logging.getLogger(__name__)
 
+# setWebhook is rate limited by telegram to about one call per second
+SET_WEBHOOK_ATTEMPTS = 5
+
 
 def command_webhook(bot_token: str, webhook_url: str):
-    async def _inner_command_webhook():
-        bot = Bot(token=bot_token)
-        if not webhook_url:
-            return "Please provide a webhook url"
-        register_webhook = await bot.set_webhook(webhook_url)
-        if register_webhook:
-            webhook = await bot.get_webhook_info()
-            logger.debug(webhook.to_json())
-        else:
-            logger.error("Failed to register webhook")
-
-    asyncio.run(_inner_command_webhook())
+    # python-telegram-bot 13 is synchronous, so the bot is called directly
+    # Token is often pasted from a file, trailing newline makes it invalid
+    bot = Bot(token=bot_token.strip())
+    if not webhook_url:
+        return "Please provide a webhook url"
+    register_webhook = False
+    for attempt in range(SET_WEBHOOK_ATTEMPTS):
+        try:
+            register_webhook = bot.set_webhook(webhook_url)
+            break
+        except RetryAfter as e:
+            if attempt == SET_WEBHOOK_ATTEMPTS - 1:
+                logger.error(f"Failed to register webhook, still rate limited: {e}")
+                return
+            logger.warning(f"setWebhook is rate limited, retrying in {e.retry_after}s")
+            time.sleep(e.retry_after)
+    if register_webhook:
+        webhook = bot.get_webhook_info()
+        logger.debug(webhook.to_json())
+    else:
+        logger.error("Failed to register webhook")
 
 
 if __name__ == "__main__":
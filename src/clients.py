@@ -0,0 +1,56 @@
+"""
+Shared Telegram and GitHub clients.
+They are created once per function instance, so connections to api.telegram.org and api.github.com
+are kept alive and reused between the updates instead of doing a TLS handshake on every call.
+"""
+
+import logging
+import os
+from functools import lru_cache
+
+from github import Github, Auth
+from telegram import Bot
+from telegram.utils.request import Request
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+# Function runs one instance that handles one request at a time, and all the calls of a request
+# are made one after another. So one kept-alive connection per host is enough.
+TELEGRAM_POOL_SIZE = 1
+# Downloads need a longer read timeout than the other bot calls, so they go through their own bot.
+TELEGRAM_FILE_POOL_SIZE = 1
+TELEGRAM_FILE_READ_TIMEOUT = 60
+GITHUB_POOL_SIZE = 1
+
+BOT_TOKEN = os.getenv("BOT_TOKEN", None)
+if BOT_TOKEN:
+    bot = Bot(token=BOT_TOKEN, request=Request(con_pool_size=TELEGRAM_POOL_SIZE))
+    # Files are downloaded through the bot that requested them, so it's a separate bot
+    file_bot = Bot(
+        token=BOT_TOKEN,
+        request=Request(
+            con_pool_size=TELEGRAM_FILE_POOL_SIZE,
+            read_timeout=TELEGRAM_FILE_READ_TIMEOUT,
+        ),
+    )
+else:
+    logger.error("BOT_TOKEN is not set")
+    bot = None
+    file_bot = None
+
+
+@lru_cache(maxsize=4)
+def get_github(github_token: str) -> Github:
+    """
+    Returns github client for the token. All the actions using the same token share one client and its connection pool.
+    :param github_token: github access token
+    :return: github client
+    """
+    return Github(
+        auth=Auth.Token(github_token),
+        pool_size=GITHUB_POOL_SIZE,
+        # Only reads are retried. A PUT that timed out could already be committed on github,
+        # resending it fails on the stale sha. Connection errors are still retried for any method.
+        retry=Retry(total=3, backoff_factor=0.2, allowed_methods=frozenset({"GET"})),
+    )
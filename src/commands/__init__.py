@@ -1,4 +1,4 @@
 from .info import command_info
 from .start import command_start
 from .webhook import command_webhook
-from .post_to_journal import PostToGitJournal, PostToTodo
+from .post_to_journal import PostToGitJournal, PostToTodo, TODO_PREFIX
@@ -1,19 +1,19 @@
 import json
 import logging
-import os
 
-from telegram import Bot, Message
+from telegram import Message
+
+from ..clients import bot
+from ..utils import ttl_cache
 
 logger = logging.getLogger(__name__)
 
-BOT_TOKEN = os.getenv("BOT_TOKEN", None)
-if BOT_TOKEN:
-    bot = Bot(token=BOT_TOKEN)
-else:
-    logger.error("BOT_TOKEN is not set")
-    bot = None
+
+@ttl_cache(300)
+def _get_bot_info():
+    # Cached already serialized, so a hit returns the string as is
+    return json.dumps(bot.get_me().to_dict())
 
 
 def command_info(message: Message):
-    bot_info = bot.get_me()
-    return json.dumps(bot_info.to_dict())
+    return _get_bot_info()
@@ -3,15 +3,71 @@ in this task, I take the message from telegram command, and post it to my journa
 I will use the github api to do this.
 """
 
+import base64
 import logging
+import mmap
+import re
+import threading
+import time
 from datetime import datetime
+from functools import lru_cache
+from os.path import basename
+from urllib.parse import quote
 
-from github import Github, Auth
+from github import GithubException
 from telegram import Message
-from utils import get_text_from_message
+
+from ..clients import get_github
+from ..utils import get_text_from_message
 
 logger = logging.getLogger(__name__)
 
+# Last known files, keyed by (repo name, file path). Value is (etag, sha, decoded content).
+# Etag is None when the content was written by the bot itself.
+_contents_cache = {}
+# Function handles one request at a time now, but the cache is shared by all the request threads
+# if concurrency is raised, so updates of the same file still go one by one.
+# Locks are kept next to the cache and keyed the same way, so all the actions writing a file share its lock.
+_file_locks = {}
+_file_locks_lock = threading.Lock()
+
+# Todo messages start with "todo". Messages are routed to todo by it, and it's removed from the item
+TODO_PREFIX = re.compile(r"^todo\s+", re.IGNORECASE)
+
+# With fewer github requests left than this, the bot waits for the limit reset
+RATE_LIMIT_THRESHOLD = 50
+# Messages are handled within the webhook request, so the wait has to fit the 60s function timeout
+MAX_RATE_LIMIT_WAIT = 30
+
+
+def _now() -> str:
+    """
+    Current time for org entries, like 2024-01-31 18:05.
+    Formatted by hand, it's cheaper than strftime.
+    """
+    now = datetime.now()
+    date = f"{now.year:04d}-{now.month:02d}-{now.day:02d}"
+    return f"{date} {now.hour:02d}:{now.minute:02d}"
+
+
+def _file_lock(key):
+    """
+    Returns the lock for a (repo name, file path) key, it's created on the first use.
+    """
+    with _file_locks_lock:
+        lock = _file_locks.get(key)
+        if lock is None:
+            lock = _file_locks[key] = threading.Lock()
+        return lock
+
+
+@lru_cache(maxsize=4)
+def _get_repo(github_token, repo_name):
+    """
+    get_repo is an api call, so repo object is fetched once and shared between the actions.
+    """
+    return get_github(github_token).get_repo(repo_name)
+
 
 class BasePostToGitJournal:
     def __init__(self, github_token=None, repo_name=None, file_path=None):
@@ -26,11 +82,111 @@ class BasePostToGitJournal:
             # warning in logs that default file path is used
             logger.warning("File path is not provided. Using default file path.")
 
-        self.client = Github(auth=(Auth.Token(self.token)))
-        # Initialize using an access token
+        # Client is shared between the actions, so connections to github are reused
+        self.client = get_github(self.token)
 
         # Get the specific repo and file
-        self.repo = self.client.get_repo(self.repo_name)
+        self.repo = _get_repo(self.token, self.repo_name)
+
+    def _get_contents(self):
+        """
+        Returns the file content the bot wrote last time, if there is one.
+        Otherwise fetches the file with a conditional request. If file wasn't changed since the last fetch,
+        github returns 304 without body, and such responses don't count against the rate limit.
+        :return: sha and decoded content of the file
+        """
+        key = (self.repo_name, self.file_path)
+        cached = _contents_cache.get(key)
+        if cached and cached[0] is None:
+            return cached[1], cached[2]
+        headers = {"If-None-Match": cached[0]} if cached else {}
+        response_headers, data = self.repo._requester.requestJsonAndCheck(
+            "GET",
+            f"{self.repo.url}/contents/{quote(self.file_path)}",
+            parameters={"ref": "main"},  # Assuming you're working on the 'main' branch
+            headers=headers,
+        )
+        if data is None and cached:
+            logger.debug("File is not modified, using cached content")
+            return cached[1], cached[2]
+
+        if data.get("encoding") == "base64":
+            decoded_content = base64.b64decode(data["content"])
+        else:
+            # Files over 1 MB come without content, blob api returns them up to 100 MB
+            decoded_content = self._get_blob(data["sha"])
+        _contents_cache[key] = (
+            response_headers.get("etag"),
+            data["sha"],
+            decoded_content,
+        )
+        return data["sha"], decoded_content
+
+    def _get_blob(self, sha: str) -> bytes:
+        """
+        Fetches file content from the git blob api.
+        :param sha: sha of the file
+        :return: decoded content of the file
+        """
+        blob = self.repo.get_git_blob(sha)
+        if blob.encoding != "base64":
+            # Decoding anything else could append the entry to a wrong or empty content
+            raise ValueError(f"Unexpected blob encoding: {blob.encoding}")
+        return base64.b64decode(blob.content)
+
+    def _check_rate_limit(self):
+        """
+        Slows down when github rate limit is almost used up, so messages don't fail with 403.
+        Rate limit is read from the requester, it's taken from the headers of the last response.
+        Client's rate_limiting isn't used, it makes a request when there was no response yet.
+        :return:
+        """
+        requester = self.repo._requester
+        remaining, limit = requester.rate_limiting
+        if limit < 0 or remaining >= RATE_LIMIT_THRESHOLD:
+            return
+        reset_in = requester.rate_limiting_resettime - time.time()
+        logger.warning(
+            "Github rate limit is almost used up.",
+            extra={
+                "action": "rate_limit",
+                "remaining": remaining,
+                "limit": limit,
+                "reset_in": reset_in,
+            },
+        )
+        if reset_in > 0:
+            time.sleep(min(reset_in, MAX_RATE_LIMIT_WAIT))
+
+    def _upload_file(self, local_path: str, path: str, commit_message: str):
+        """
+        Uploads a local file to the repo.
+        File is encoded to base64 straight from a memory map, so it's not read into a python bytes object first.
+        :param local_path: path to the file on disk
+        :param path: path of the file in the repo
+        :param commit_message: commit message
+        :return:
+        """
+        with open(local_path, "rb") as file, mmap.mmap(
+            file.fileno(), 0, access=mmap.ACCESS_READ
+        ) as mapped:
+            content = base64.b64encode(mapped).decode("ascii")
+        try:
+            self.repo._requester.requestJsonAndCheck(
+                "PUT",
+                f"{self.repo.url}/contents/{quote(path)}",
+                input={
+                    "message": commit_message,
+                    "content": content,
+                    "branch": "main",
+                },
+            )
+        except GithubException as e:
+            if e.status != 422:
+                raise
+            # Files are named by telegram file id, so an existing file is the same photo.
+            # It happens when telegram delivers the message again.
+            logger.info("File is already in the repo, reusing it", extra={"path": path})
 
     def _append_text_to_file(
         self, new_text: str, commit_message: str, filename: str = None
@@ -44,27 +200,38 @@ class BasePostToGitJournal:
             },
         )
 
-        contents = self.repo.get_contents(
-            self.file_path, ref="main"
-        )  # Assuming you're working on the 'main' branch
-
-        # Decode the content and append new text
-        decoded_content = contents.decoded_content.decode("utf-8")
+        image_text = ""
         if filename:
             # [[file:pics/minecraft_sorter_scheme_b.png]]
-            image_text = f"#+attr_html: :width 600px\n[[file:{filename}]]"
-            new_content = "\n".join([decoded_content, new_text, image_text])
-        else:
-            new_content = "\n".join([decoded_content, new_text])
-
-        # Update the file in the repository
-        self.repo.update_file(
-            path=contents.path,
-            message=commit_message,
-            content=new_content,
-            sha=contents.sha,
-            branch="main",
-        )
+            image_text = f"\n#+attr_html: :width 600px\n[[file:{filename}]]"
+        # Journal stays as bytes, only the new text is encoded and appended.
+        # update_file accepts bytes, so there's no decode and encode of the whole file.
+        new_bytes = f"\n{new_text}{image_text}".encode("utf-8")
+
+        key = (self.repo_name, self.file_path)
+        with _file_lock(key):
+            for attempt in range(2):
+                sha, raw_content = self._get_contents()
+                new_content = raw_content + new_bytes
+                try:
+                    # Update the file in the repository
+                    result = self.repo.update_file(
+                        path=self.file_path,
+                        message=commit_message,
+                        content=new_content,
+                        sha=sha,
+                        branch="main",
+                    )
+                except GithubException as e:
+                    if attempt or e.status not in (409, 422):
+                        raise
+                    # File was changed outside the bot, so the cached sha is stale
+                    logger.warning("File sha mismatch, fetching the file again")
+                    _contents_cache.pop(key, None)
+                    continue
+                # Next append starts from what was just written, without fetching
+                _contents_cache[key] = (None, result["content"].sha, new_content)
+                return
 
     def run(self, message: Message, file_path=None):
         """
@@ -73,25 +240,32 @@ class BasePostToGitJournal:
         :return: status of operation
         """
 
+        # Checked once before any request and outside the file lock,
+        # so a photo message waits at most once and other appends aren't blocked
+        self._check_rate_limit()
+
         filename = None
         if file_path:
-            # we got a file. Now it has to be uploaded to the repo as bytes
-            with open(file_path, "rb") as file:
-                file_bytes = file.read()
-                filename = "pics/telegram/" + file_path.split("/")[-1]
-                self.repo.create_file(
-                    path=filename,
-                    message="Image from telegram",
-                    content=file_bytes,
-                    branch="main",
-                )
+            # we got a file. Now it has to be uploaded to the repo
+            filename = f"pics/telegram/{basename(file_path)}"
+            self._upload_file(file_path, filename, "Image from telegram")
 
+        commit_message, new_text = self._build_entry(message)
+        self._append_text_to_file(new_text, commit_message, filename)
+        return True
+
+    def _build_entry(self, message: Message) -> tuple[str, str]:
+        """
+        Builds the commit message and the org item. Message ids are read once for both of them.
+        Subclasses override only _get_org_item, so the commit message stays the same for all files.
+        :param message: incoming telegram message
+        :return: commit message and org item
+        """
         message_id = message.message_id
         chat_id = message.chat.id
+        message_link = f"https://t.me/c/{chat_id}/{message_id}"
         commit_message = f"Message {message_id} from chat {chat_id}"
-        new_text = self._get_org_item(message)
-        self._append_text_to_file(new_text, commit_message, filename)
-        return True
+        return commit_message, self._get_org_item(message, message_link)
 
 
 class PostToTodo(BasePostToGitJournal):
@@ -100,34 +274,33 @@ class PostToTodo(BasePostToGitJournal):
     """
 
     @staticmethod
-    def _get_org_item(message: Message) -> str:
+    def _get_org_item(message: Message, message_link: str) -> str:
         """
         In this method, I'm making an message for my org-mode journal.
         It includes title "log entry" and link to the message.
         Text of the message is written in the next line.
+        :param message: incoming telegram message
+        :param message_link: link to the message
+        :return: org item
         """
-        message_id = message.message_id
-        chat_id = message.chat.id
-        now = datetime.now().strftime("%Y-%m-%d %H:%M")
-        message_link = f"https://t.me/c/{chat_id}/{message_id}"
+        now = _now()
         # trimming TODO from the message, I may want to use different tags later on
-        message_text = get_text_from_message(message)
-        message_text = message_text[5:]
+        message_text = TODO_PREFIX.sub("", get_text_from_message(message), count=1)
         return f"** TODO {message_text}\nCreated at: [{now}] from {message_link}"
 
 
 class PostToGitJournal(BasePostToGitJournal):
 
     @staticmethod
-    def _get_org_item(message: Message) -> str:
+    def _get_org_item(message: Message, message_link: str) -> str:
         """
         In this method, I'm making an message for my org-mode journal.
         It includes title "log entry" and link to the message.
         Text of the message is written in the next line.
+        :param message: incoming telegram message
+        :param message_link: link to the message
+        :return: org item
         """
-        message_id = message.message_id
-        chat_id = message.chat.id
-        now = datetime.now().strftime("%Y-%m-%d %H:%M")
-        message_link = f"https://t.me/c/{chat_id}/{message_id}"
+        now = _now()
         message_text = get_text_from_message(message)
         return f"* Entry: [[{message_link}][{now}]]\n{message_text}"
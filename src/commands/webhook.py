@@ -1,17 +1,17 @@
 import logging
-import os
 
-from telegram import Message, Bot
+from telegram import Message
+
+from ..clients import bot
+from ..utils import ttl_cache
 
 logger = logging.getLogger(__name__)
 
-BOT_TOKEN = os.getenv("BOT_TOKEN", None)
-if BOT_TOKEN:
-    bot = Bot(token=BOT_TOKEN)
-else:
-    logger.error("BOT_TOKEN is not set")
-    bot = None
+
+@ttl_cache(60)
+def _get_webhook_info():
+    return bot.get_webhook_info().to_json()
 
 
 def command_webhook(message: Message):
-    return bot.get_webhook_info().to_json()
+    return _get_webhook_info()
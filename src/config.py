@@ -1,4 +1,6 @@
 import os
+from functools import lru_cache
+from types import MappingProxyType
 
 from .commands import (
     command_start,
@@ -8,11 +10,14 @@ from .commands import (
     PostToTodo,
 )
 
-commands = {
-    "/start": command_start,
-    "/webhook": command_webhook,
-    "/info": command_info,
-}
+# Registries are fixed at startup, so they are read-only
+commands = MappingProxyType(
+    {
+        "/start": command_start,
+        "/webhook": command_webhook,
+        "/info": command_info,
+    }
+)
 
 
 # Configuration is coming from "JOURNAL_FILE" env variable.
@@ -21,16 +26,36 @@ github_token = os.getenv("GITHUB_TOKEN", None)
 repo_name = os.getenv("GITHUB_REPO", None)
 file_path = os.getenv("JOURNAL_FILE", "journal.md")
 
-journal = PostToGitJournal(
-    github_token=github_token, repo_name=repo_name, file_path=file_path
-)
+# Actions connect to github when they are created,
+# so it's done on the first message instead of the import. Failed creation is retried on the next message.
+@lru_cache(maxsize=1)
+def get_journal():
+    return PostToGitJournal(
+        github_token=github_token, repo_name=repo_name, file_path=file_path
+    )
+
+
+@lru_cache(maxsize=1)
+def get_todo():
+    return PostToTodo(
+        github_token=github_token, repo_name=repo_name, file_path="todo.org"
+    )
+
+
+def post_to_journal(message, file_path=None):
+    return get_journal().run(message, file_path=file_path)
+
+
+def post_to_todo(message, file_path=None):
+    return get_todo().run(message, file_path=file_path)
 
-todo = PostToTodo(github_token=github_token, repo_name=repo_name, file_path="todo.org")
 
 # Default action is to post to journal
-default_action = journal.run
+default_action = post_to_journal
 
-actions = {
-    "journal": {"handler": journal.run, "response": "Added to journal!"},
-    "todo": {"handler": todo.run, "response": "Added to todo list!"},
-}
+actions = MappingProxyType(
+    {
+        "journal": {"handler": post_to_journal, "response": "Added to journal!"},
+        "todo": {"handler": post_to_todo, "response": "Added to todo list!"},
+    }
+)
@@ -1,64 +1,111 @@
 import logging
 import os
+import threading
+from collections import OrderedDict
+from contextlib import suppress
 
 import functions_framework
 from flask import Request, abort
-from telegram import Bot, Update, Message
+from telegram import Update, Message
 
 import sentry_sdk
-from sentry_sdk.integrations.gcp import GcpIntegration
 
+from .clients import bot, file_bot
+from .commands import TODO_PREFIX
 from .config import commands, actions
 from .tracing.log import GCPLogger
-from .utils import get_text_from_message
+from .utils import get_text_from_message, open_private_file
 
 
-BOT_TOKEN = os.environ["BOT_TOKEN"]
-bot = Bot(token=BOT_TOKEN)
-
 # Set the new logger class
 logging.setLoggerClass(GCPLogger)
 
 logger = logging.getLogger(__name__)
+LOGLEVEL = os.environ.get("LOGLEVEL", "INFO").upper()
+logger.setLevel(LOGLEVEL)
+
+# Bot can't work without the token, so the function fails on start and not on every update
+BOT_TOKEN = os.environ["BOT_TOKEN"]
 
 SENTRY_DSN = os.environ.get("SENTRY_DSN", "")
 
-sentry_sdk.init(
-    dsn=SENTRY_DSN,
-    integrations=[GcpIntegration()],
-    # Set traces_sample_rate to 1.0 to capture 100%
-    # of transactions for performance monitoring.
-    traces_sample_rate=1.0,
-    # Set profiles_sample_rate to 1.0 to profile 100%
-    # of sampled transactions.
-    # We recommend adjusting this value in production.
-    profiles_sample_rate=1.0,
-)
+# Without DSN sentry doesn't send anything, so integration isn't even imported.
+# capture_exception is a no-op until init is called.
+if SENTRY_DSN:
+    from sentry_sdk.integrations.gcp import GcpIntegration
+
+    sentry_sdk.init(
+        dsn=SENTRY_DSN,
+        integrations=[GcpIntegration()],
+        # Set traces_sample_rate to 1.0 to capture 100%
+        # of transactions for performance monitoring.
+        traces_sample_rate=1.0,
+        # Set profiles_sample_rate to 1.0 to profile 100%
+        # of sampled transactions.
+        # We recommend adjusting this value in production.
+        profiles_sample_rate=1.0,
+    )
 
 
-def send_back(message: Message, text):
+def webhook_reply(chat_id: int, message_id: int, text):
     """
-    Sends a message back to the user. Using telegram bot's sendMessage method.
-    :param message: incoming telegram message
-    :param text:
-    :return:
+    Builds a sendMessage call to be returned as the webhook response.
+    Telegram executes it by itself, so it saves a request to the bot api.
+    :param chat_id: chat to reply to
+    :param message_id: message to reply to
+    :param text: reply text
+    :return: webhook response body
     """
-    bot.send_message(
-        chat_id=message.chat_id, text=text, reply_to_message_id=message.message_id
-    )
+    return {
+        "method": "sendMessage",
+        "chat_id": chat_id,
+        "text": text,
+        "reply_to_message_id": message_id,
+    }
+
+
+# Photos saved to /tmp by file id, the oldest first.
+# /tmp is kept in memory on cloud functions, so only the last few photos are kept.
+PHOTO_CACHE_SIZE = 16
+saved_photos = OrderedDict()
+saved_photos_lock = threading.Lock()
 
 
-def handle_message(message: Message):
+def save_photo(file_id):
     """
-    Handles incoming telegram message.
-    :param message: incoming telegram message
-    :return:
+    Downloads a photo to /tmp.
+    Telegram can deliver the same photo again, so a photo that is already saved isn't downloaded.
+    :param file_id: telegram file id of the photo
+    :return: path to the saved photo
     """
-    response = process_message(message)
-    if response:
-        send_back(message, response)
-    else:
-        send_back(message, "I don't understand")
+    file_path = f"/tmp/{file_id}.jpg"
+    with saved_photos_lock:
+        if file_id in saved_photos and os.path.exists(file_path):
+            saved_photos.move_to_end(file_id)
+            return file_path
+
+    photo_file = file_bot.get_file(file_id)
+    # Downloaded bytes are written out as is, without a bytearray copy.
+    try:
+        with open_private_file(file_path) as file:
+            photo_file.download(out=file)
+    except Exception:
+        # Partial file isn't in saved_photos, so eviction would never remove it from /tmp
+        with suppress(FileNotFoundError):
+            os.remove(file_path)
+        raise
+
+    with saved_photos_lock:
+        saved_photos[file_id] = file_path
+        while len(saved_photos) > PHOTO_CACHE_SIZE:
+            _, old_path = saved_photos.popitem(last=False)
+            with suppress(FileNotFoundError):
+                os.remove(old_path)
+    return file_path
+
+
+def unrecognized_command(message: Message):
+    return "Unrecognized command"
 
 
 def process_message(message: Message):
@@ -68,35 +115,31 @@ def process_message(message: Message):
     # Check if the message is a command
 
     message_text = get_text_from_message(message)
-    if message.photo:
+    photo = message.photo
+    if photo:
         # we got a picture.
-        # let's save it to a random file in /tmp
+        # let's save it to a file in /tmp
         # and then pass it command to insert it into the journal
-        random_filename = f"/tmp/{message.photo[-1].file_id}.jpg"
-        with open(random_filename, "wb") as file:
-            file.write(bot.get_file(message.photo[-1].file_id).download_as_bytearray())
+        photo_path = save_photo(photo[-1].file_id)
         logger.debug("Photo received")
-        return process_non_command(message, file_path=random_filename)
+        return process_non_command(message, message_text, file_path=photo_path)
     elif message_text.startswith("/"):
-        command_text = message.text.split("@")[0]  # Split command and bot's name
-        command = commands.get(command_text)
-        if command:
-            return command(
-                message, file_path=random_filename if message.photo else None
-            )
-        else:
-            return "Unrecognized command"
+        # Command is the first word, split command and bot's name
+        command_text = message_text.partition(" ")[0].partition("@")[0]
+        return commands.get(command_text, unrecognized_command)(message)
     else:
-        return process_non_command(message)
+        return process_non_command(message, message_text)
 
 
-def process_non_command(message: Message, file_path=None):
+def process_non_command(message: Message, message_text: str, file_path=None):
     # Your code here to process non-command messages
     logger.debug("Processing non-command message")
-    logger.debug(message.to_json())
+    if logger.isEnabledFor(logging.DEBUG):
+        # Serializing the whole message is expensive, do it only when it's logged
+        logger.debug(message.to_json())
 
-    message_text = get_text_from_message(message)
-    if message_text.lower().startswith("todo "):
+    # Only the start of the message is matched, entries can be long
+    if TODO_PREFIX.match(message_text):
         action = "todo"
     else:
         action = "journal"
@@ -106,21 +149,20 @@ def process_non_command(message: Message, file_path=None):
             actions[action]["handler"](message, file_path=file_path)
             return actions[action]["response"]
     except Exception as e:
-        logger.error(e)
+        logger.error(f"Failed to run {action} action: {e}")
         return "Failed to add to journal."
 
 
-authorized_chats = [
+authorized_chats = frozenset(
     int(authorized_chat)
     for authorized_chat in os.environ["AUTHORIZED_CHAT_IDS"].split(",")
-]
+)
 
 
-def auth_check(message: Message):
-    if message.chat_id in authorized_chats:
+def auth_check(chat_id: int):
+    if chat_id in authorized_chats:
         return True
     logger.info("Unauthorized chat id")
-    send_back(message, "It's not for you!")
     return False
 
 
@@ -128,7 +170,10 @@ def auth_check(message: Message):
 def handle(request: Request):
     """
     Incoming telegram webhook handler for a GCP Cloud Function.
-    When request is received, body is parsed into standard telegram message model, and then forwarded to command handler.
+    When request is received, body is parsed into standard telegram message model.
+    Messages are handled before the response is returned: cloud function gets CPU only while
+    a request is in flight, and Telegram doesn't redeliver an update that was already acknowledged.
+    Every reply is sent in the webhook response, so there's no separate call to the bot api.
     """
     if request.method == "GET":
         return {"statusCode": 200}
@@ -136,15 +181,29 @@ def handle(request: Request):
     if request.method == "POST":
         try:
             incoming_data = request.get_json()
-            logger.debug(f"incoming data: {incoming_data}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"incoming data: {incoming_data}")
+            # Chat is checked on the raw update, so updates from other chats aren't parsed
+            raw_message = incoming_data.get("message") or incoming_data.get(
+                "edited_message"
+            )
+            if not raw_message:
+                return {"statusCode": 200}
+            chat_id = raw_message["chat"]["id"]
+            if not auth_check(chat_id):
+                return webhook_reply(
+                    chat_id, raw_message["message_id"], "It's not for you!"
+                )
+
             update_message = Update.de_json(incoming_data, bot)
             message = update_message.message or update_message.edited_message
-            if auth_check(message):
-                handle_message(message)
-            return {"statusCode": 200}
+            response = process_message(message)
+            return webhook_reply(
+                chat_id, message.message_id, response or "I don't understand"
+            )
         except Exception as e:
             sentry_sdk.capture_exception(e)
-            logger.error("Error occurred but message wasn't processed")
+            logger.error("Error occurred but update wasn't processed")
             return {"statusCode": 200}
 
     # Unprocessable entity
@@ -1,3 +1,8 @@
+import os
+import threading
+import time
+from functools import wraps
+
 from telegram import Message
 
 
@@ -12,3 +17,42 @@ def get_text_from_message(message: Message):
         return message.caption
     else:
         return "%% No text %%"
+
+
+def ttl_cache(ttl: float):
+    """
+    Caches the result of a function without arguments for `ttl` seconds.
+    It's used for telegram api responses that rarely change, so repeated commands don't go to the api.
+    :param ttl: time to keep the result, in seconds
+    :return: decorator
+    """
+
+    def decorator(func):
+        lock = threading.Lock()
+        cache = {}
+
+        @wraps(func)
+        def wrapper():
+            with lock:
+                now = time.monotonic()
+                if "value" not in cache or now >= cache["expires_at"]:
+                    cache["value"] = func()
+                    cache["expires_at"] = now + ttl
+                return cache["value"]
+
+        wrapper.cache_clear = cache.clear
+        return wrapper
+
+    return decorator
+
+
+def open_private_file(file_path: str):
+    """
+    Opens a file for binary writing, readable only by the process user.
+    File isn't buffered, so writes go straight to the descriptor without a copy in a BufferedWriter.
+    Mode is applied only when the file is created, an existing file keeps its permissions.
+    :param file_path: path to the file
+    :return: unbuffered file object
+    """
+    fd = os.open(file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    return os.fdopen(fd, "wb", buffering=0)
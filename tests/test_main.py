@@ -0,0 +1,135 @@
+import os
+import uuid
+from types import SimpleNamespace
+from unittest import TestCase, mock
+
+from telegram.error import NetworkError
+
+# main reads its configuration on import
+os.environ.setdefault("BOT_TOKEN", "123456:TEST")
+os.environ.setdefault("AUTHORIZED_CHAT_IDS", "42")
+
+from src import main
+
+AUTHORIZED_CHAT_ID = next(iter(main.authorized_chats))
+
+
+def webhook_request(update: dict):
+    return SimpleNamespace(method="POST", get_json=lambda: update)
+
+
+def update_with_text(text: str, chat_id: int = AUTHORIZED_CHAT_ID):
+    return {
+        "update_id": 1,
+        "message": {
+            "message_id": 5,
+            "date": 0,
+            "chat": {"id": chat_id, "type": "private"},
+            "text": text,
+        },
+    }
+
+
+def fake_actions():
+    return {
+        "journal": {"handler": mock.Mock(), "response": "Added to journal!"},
+        "todo": {"handler": mock.Mock(), "response": "Added to todo list!"},
+    }
+
+
+class TestHandle(TestCase):
+    def test_update_without_message(self):
+        self.assertEqual(
+            main.handle(webhook_request({"update_id": 1})), {"statusCode": 200}
+        )
+
+    def test_unauthorized_chat(self):
+        """
+        Updates from other chats are answered without parsing.
+        """
+        with mock.patch.object(main.Update, "de_json") as de_json:
+            response = main.handle(webhook_request(update_with_text("hello", 1)))
+        self.assertEqual(response, main.webhook_reply(1, 5, "It's not for you!"))
+        de_json.assert_not_called()
+
+    def test_command_is_answered_in_response(self):
+        response = main.handle(webhook_request(update_with_text("/start")))
+        self.assertEqual(
+            response, main.webhook_reply(AUTHORIZED_CHAT_ID, 5, "Hello brain!")
+        )
+
+    def test_message_is_answered_in_response(self):
+        actions = fake_actions()
+        with mock.patch.object(main, "actions", actions):
+            response = main.handle(webhook_request(update_with_text("hello")))
+        self.assertEqual(
+            response, main.webhook_reply(AUTHORIZED_CHAT_ID, 5, "Added to journal!")
+        )
+        actions["journal"]["handler"].assert_called_once()
+
+    def test_failed_action_is_answered_in_response(self):
+        actions = fake_actions()
+        actions["journal"]["handler"].side_effect = RuntimeError("github is down")
+        with mock.patch.object(main, "actions", actions):
+            response = main.handle(webhook_request(update_with_text("hello")))
+        self.assertEqual(
+            response,
+            main.webhook_reply(AUTHORIZED_CHAT_ID, 5, "Failed to add to journal."),
+        )
+
+
+class TestTodoRouting(TestCase):
+    def route(self, text: str):
+        actions = fake_actions()
+        with mock.patch.object(main, "actions", actions):
+            return main.process_non_command(mock.Mock(), text)
+
+    def test_todo_prefix(self):
+        self.assertEqual(self.route("todo buy milk"), "Added to todo list!")
+        self.assertEqual(self.route("TODO  buy milk"), "Added to todo list!")
+
+    def test_todo_in_the_middle(self):
+        self.assertEqual(self.route("buy milk todo"), "Added to journal!")
+        self.assertEqual(self.route("todolist"), "Added to journal!")
+
+
+class TestSavePhoto(TestCase):
+    def setUp(self):
+        main.saved_photos.clear()
+        self.file_ids = [uuid.uuid4().hex for _ in range(2)]
+        self.photo_file = mock.Mock()
+        self.photo_file.download.side_effect = lambda out: out.write(b"photo")
+
+    def tearDown(self):
+        for file_id in self.file_ids:
+            if os.path.exists(f"/tmp/{file_id}.jpg"):
+                os.remove(f"/tmp/{file_id}.jpg")
+        main.saved_photos.clear()
+
+    def test_saved_photo_is_not_downloaded(self):
+        with mock.patch.object(main, "file_bot") as file_bot:
+            file_bot.get_file.return_value = self.photo_file
+            first_path = main.save_photo(self.file_ids[0])
+            second_path = main.save_photo(self.file_ids[0])
+        self.assertEqual(first_path, second_path)
+        file_bot.get_file.assert_called_once()
+
+    def test_eviction_removes_file(self):
+        with mock.patch.object(main, "file_bot") as file_bot, mock.patch.object(
+            main, "PHOTO_CACHE_SIZE", 1
+        ):
+            file_bot.get_file.return_value = self.photo_file
+            first_path = main.save_photo(self.file_ids[0])
+            second_path = main.save_photo(self.file_ids[1])
+        self.assertFalse(os.path.exists(first_path))
+        self.assertTrue(os.path.exists(second_path))
+        self.assertEqual(list(main.saved_photos), [self.file_ids[1]])
+
+    def test_failed_download_removes_file(self):
+        self.photo_file.download.side_effect = NetworkError("timeout")
+        with mock.patch.object(main, "file_bot") as file_bot:
+            file_bot.get_file.return_value = self.photo_file
+            with self.assertRaises(NetworkError):
+                main.save_photo(self.file_ids[0])
+        self.assertFalse(os.path.exists(f"/tmp/{self.file_ids[0]}.jpg"))
+        self.assertEqual(len(main.saved_photos), 0)
@@ -1,10 +1,86 @@
+import base64
 import os
-from unittest import TestCase
+from types import SimpleNamespace
+from tempfile import NamedTemporaryFile
+from unittest import TestCase, mock
 
-from src.commands.post_to_journal import PostToGitJournal
+from github import GithubException
+
+from src.commands import post_to_journal
+from src.commands.post_to_journal import PostToGitJournal, PostToTodo
+from src.utils import get_text_from_message
+
+
+class FakeRequester:
+    """
+    Returns the given responses in order, like PyGithub's requestJsonAndCheck.
+    Exceptions in the responses are raised.
+    """
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = []
+        self.rate_limiting = (-1, -1)
+        self.rate_limiting_resettime = 0
+
+    def requestJsonAndCheck(self, verb, url, parameters=None, headers=None, input=None):
+        self.calls.append(
+            {"verb": verb, "url": url, "headers": headers, "input": input}
+        )
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+class FakeRepo:
+    url = "https://api.github.com/repos/iamkarlson/braindb"
+
+    def __init__(self, requester, update_errors=(), blobs=None):
+        self._requester = requester
+        self.update_errors = list(update_errors)
+        self.updates = []
+        self.blobs = blobs or {}
+
+    def update_file(self, path, message, content, sha, branch):
+        self.updates.append(
+            {"path": path, "message": message, "content": content, "sha": sha}
+        )
+        if self.update_errors:
+            raise self.update_errors.pop(0)
+        return {"content": SimpleNamespace(sha=f"written-{len(self.updates)}")}
+
+    def get_git_blob(self, sha):
+        return SimpleNamespace(
+            encoding="base64", content=base64.b64encode(self.blobs[sha]).decode()
+        )
+
+
+def contents_response(content: bytes, sha: str, etag: str):
+    return {"etag": etag}, {
+        "sha": sha,
+        "encoding": "base64",
+        "content": base64.b64encode(content).decode(),
+    }
+
+
+def make_message(text: str):
+    return SimpleNamespace(
+        message_id=1, chat=SimpleNamespace(id=1), text=text, caption=None
+    )
+
+
+def make_task(repo, task_class=PostToGitJournal, file_path="test_journal.org"):
+    with mock.patch.object(post_to_journal, "_get_repo", return_value=repo):
+        return task_class(
+            github_token="token", repo_name="iamkarlson/braindb", file_path=file_path
+        )
 
 
 class TestPostToGitJournal(TestCase):
+    def setUp(self):
+        post_to_journal._contents_cache.clear()
+
     def test_run(self):
         """
         Test setups some mock data, and runs the task.
@@ -36,7 +112,228 @@ class TestPostToGitJournal(TestCase):
         task.run(message=mock_message)
 
     def test__append_text_to_file(self):
-        self.fail()
+        """
+        Stale cached sha is refetched once, and the entry is appended exactly once.
+        """
+        requester = FakeRequester(contents_response(b"* remote", "remote-sha", '"e1"'))
+        repo = FakeRepo(requester, update_errors=[GithubException(409, {}, {})])
+        task = make_task(repo)
+        key = (task.repo_name, task.file_path)
+        post_to_journal._contents_cache[key] = (None, "stale-sha", b"* cached")
+
+        task._append_text_to_file("* Entry", "Message 1 from chat 1")
+
+        self.assertEqual(len(repo.updates), 2)
+        self.assertEqual(repo.updates[0]["sha"], "stale-sha")
+        self.assertEqual(repo.updates[1]["sha"], "remote-sha")
+        self.assertEqual(repo.updates[1]["content"], b"* remote\n* Entry")
+        # Cache was dropped, so the file was fetched without If-None-Match
+        self.assertEqual(requester.calls[0]["headers"], {})
+        self.assertEqual(
+            post_to_journal._contents_cache[key],
+            (None, "written-2", b"* remote\n* Entry"),
+        )
+
+    def test__append_text_to_file_second_conflict(self):
+        requester = FakeRequester(
+            contents_response(b"* remote", "remote-sha", '"e1"'),
+            contents_response(b"* remote", "remote-sha", '"e1"'),
+        )
+        repo = FakeRepo(
+            requester,
+            update_errors=[GithubException(409, {}, {}), GithubException(409, {}, {})],
+        )
+        task = make_task(repo)
+
+        with self.assertRaises(GithubException):
+            task._append_text_to_file("* Entry", "Message 1 from chat 1")
+        self.assertEqual(len(repo.updates), 2)
+
+    def test__append_text_to_file_after_own_write(self):
+        """
+        Next append starts from what the bot wrote, without fetching the file.
+        """
+        requester = FakeRequester()
+        task = make_task(FakeRepo(requester))
+        key = (task.repo_name, task.file_path)
+        post_to_journal._contents_cache[key] = (None, "sha", b"* written")
+
+        task._append_text_to_file("* Entry", "Message 1 from chat 1")
+
+        self.assertEqual(requester.calls, [])
+        self.assertEqual(task.repo.updates[0]["sha"], "sha")
+        self.assertEqual(task.repo.updates[0]["content"], b"* written\n* Entry")
+
+    def test__build_entry(self):
+        task = make_task(FakeRepo(FakeRequester()))
+        now = "2024-01-31 18:05"
+        with mock.patch.object(post_to_journal, "_now", return_value=now):
+            commit_message, org_item = task._build_entry(make_message("text"))
+        self.assertEqual(commit_message, "Message 1 from chat 1")
+        self.assertEqual(
+            org_item, "* Entry: [[https://t.me/c/1/1][2024-01-31 18:05]]\ntext"
+        )
 
     def test__get_text_from_message(self):
-        self.fail()
+        self.assertEqual(
+            get_text_from_message(SimpleNamespace(text="text", caption="caption")),
+            "text",
+        )
+        self.assertEqual(
+            get_text_from_message(SimpleNamespace(text=None, caption="caption")),
+            "caption",
+        )
+        self.assertEqual(
+            get_text_from_message(SimpleNamespace(text=None, caption=None)),
+            "%% No text %%",
+        )
+
+
+class TestGetContents(TestCase):
+    def setUp(self):
+        post_to_journal._contents_cache.clear()
+
+    def test_not_modified_uses_cached_content(self):
+        requester = FakeRequester(({}, None))
+        task = make_task(FakeRepo(requester))
+        key = (task.repo_name, task.file_path)
+        post_to_journal._contents_cache[key] = ('"e1"', "sha", b"* cached")
+
+        self.assertEqual(task._get_contents(), ("sha", b"* cached"))
+        self.assertEqual(requester.calls[0]["headers"], {"If-None-Match": '"e1"'})
+        self.assertEqual(
+            post_to_journal._contents_cache[key], ('"e1"', "sha", b"* cached")
+        )
+
+    def test_modified_file_replaces_cached_content(self):
+        requester = FakeRequester(contents_response(b"* new", "new-sha", '"e2"'))
+        task = make_task(FakeRepo(requester))
+        key = (task.repo_name, task.file_path)
+        post_to_journal._contents_cache[key] = ('"e1"', "sha", b"* cached")
+
+        self.assertEqual(task._get_contents(), ("new-sha", b"* new"))
+        self.assertEqual(
+            post_to_journal._contents_cache[key], ('"e2"', "new-sha", b"* new")
+        )
+
+    def test_large_file_is_fetched_from_blob(self):
+        """
+        Contents api doesn't return content of files over 1 MB.
+        """
+        requester = FakeRequester(
+            ({"etag": '"e1"'}, {"sha": "sha", "encoding": "none", "content": ""}),
+            ({}, None),
+        )
+        task = make_task(FakeRepo(requester, blobs={"sha": b"* large journal"}))
+
+        self.assertEqual(task._get_contents(), ("sha", b"* large journal"))
+
+        task._append_text_to_file("* Entry", "Message 1 from chat 1")
+        self.assertEqual(task.repo.updates[0]["content"], b"* large journal\n* Entry")
+
+
+class TestUploadFile(TestCase):
+    def setUp(self):
+        post_to_journal._contents_cache.clear()
+        self.photo = NamedTemporaryFile(suffix=".jpg")
+        self.photo.write(b"photo")
+        self.photo.flush()
+        self.addCleanup(self.photo.close)
+
+    def test_photo_is_uploaded_as_base64(self):
+        requester = FakeRequester(({}, {}))
+        task = make_task(FakeRepo(requester))
+
+        task._upload_file(
+            self.photo.name, "pics/telegram/a b.jpg", "Image from telegram"
+        )
+
+        call = requester.calls[0]
+        self.assertEqual(call["verb"], "PUT")
+        self.assertEqual(
+            call["url"], f"{FakeRepo.url}/contents/pics/telegram/a%20b.jpg"
+        )
+        self.assertEqual(
+            call["input"],
+            {
+                "message": "Image from telegram",
+                "content": base64.b64encode(b"photo").decode(),
+                "branch": "main",
+            },
+        )
+
+    def test_photo_already_in_repo(self):
+        """
+        Redelivered photo is already uploaded, github rejects it without sha.
+        """
+        requester = FakeRequester(
+            GithubException(422, {"message": '"sha" wasn\'t supplied.'}, {}),
+            contents_response(b"* journal", "sha", '"e1"'),
+        )
+        task = make_task(FakeRepo(requester))
+
+        self.assertTrue(task.run(make_message("photo"), file_path=self.photo.name))
+
+        filename = os.path.basename(self.photo.name)
+        self.assertIn(
+            f"[[file:pics/telegram/{filename}]]".encode(),
+            task.repo.updates[0]["content"],
+        )
+
+    def test_other_upload_errors_are_raised(self):
+        requester = FakeRequester(GithubException(500, {}, {}))
+        task = make_task(FakeRepo(requester))
+
+        with self.assertRaises(GithubException):
+            task.run(make_message("photo"), file_path=self.photo.name)
+        self.assertEqual(task.repo.updates, [])
+
+
+class TestCheckRateLimit(TestCase):
+    def setUp(self):
+        self.requester = FakeRequester()
+        self.task = make_task(FakeRepo(self.requester))
+
+    def test_unknown_limit_is_not_fetched(self):
+        with mock.patch.object(post_to_journal.time, "sleep") as sleep:
+            self.task._check_rate_limit()
+        sleep.assert_not_called()
+        self.assertEqual(self.requester.calls, [])
+
+    def test_enough_requests_left(self):
+        self.requester.rate_limiting = (4000, 5000)
+        with mock.patch.object(post_to_journal.time, "sleep") as sleep:
+            self.task._check_rate_limit()
+        sleep.assert_not_called()
+
+    def test_waits_for_reset(self):
+        self.requester.rate_limiting = (10, 5000)
+        self.requester.rate_limiting_resettime = 1010
+        with mock.patch.object(
+            post_to_journal.time, "time", return_value=1000
+        ), mock.patch.object(post_to_journal.time, "sleep") as sleep:
+            self.task._check_rate_limit()
+        sleep.assert_called_once_with(10)
+
+    def test_wait_is_capped(self):
+        self.requester.rate_limiting = (10, 5000)
+        self.requester.rate_limiting_resettime = 5000
+        with mock.patch.object(
+            post_to_journal.time, "time", return_value=1000
+        ), mock.patch.object(post_to_journal.time, "sleep") as sleep:
+            self.task._check_rate_limit()
+        sleep.assert_called_once_with(post_to_journal.MAX_RATE_LIMIT_WAIT)
+
+
+class TestPostToTodo(TestCase):
+    def todo_text(self, text: str):
+        org_item = PostToTodo._get_org_item(make_message(text), "https://t.me/c/1/1")
+        return org_item.partition("\n")[0]
+
+    def test_prefix_is_removed(self):
+        self.assertEqual(self.todo_text("Todo  buy milk"), "** TODO buy milk")
+
+    def test_only_the_prefix_is_removed(self):
+        self.assertEqual(
+            self.todo_text("todo write todo list"), "** TODO write todo list"
+        )
@@ -0,0 +1,60 @@
+import io
+import os
+import stat
+from tempfile import TemporaryDirectory
+from unittest import TestCase, mock
+
+from src import utils
+from src.utils import open_private_file, ttl_cache
+
+
+class TestTtlCache(TestCase):
+    def setUp(self):
+        self.calls = 0
+
+        @ttl_cache(60)
+        def cached():
+            self.calls += 1
+            return self.calls
+
+        self.cached = cached
+
+    def test_result_is_cached(self):
+        with mock.patch.object(utils.time, "monotonic", return_value=100):
+            self.assertEqual(self.cached(), 1)
+            self.assertEqual(self.cached(), 1)
+        self.assertEqual(self.calls, 1)
+
+    def test_result_expires(self):
+        with mock.patch.object(utils.time, "monotonic", return_value=100):
+            self.cached()
+        with mock.patch.object(utils.time, "monotonic", return_value=160):
+            self.assertEqual(self.cached(), 2)
+
+    def test_cache_clear(self):
+        self.cached()
+        self.cached.cache_clear()
+        self.assertEqual(self.cached(), 2)
+
+
+class TestOpenPrivateFile(TestCase):
+    def setUp(self):
+        directory = TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.file_path = os.path.join(directory.name, "photo.jpg")
+
+    def test_file_is_private_and_unbuffered(self):
+        with open_private_file(self.file_path) as file:
+            self.assertIsInstance(file, io.FileIO)
+            file.write(b"photo")
+            # Nothing is left in a buffer
+            self.assertEqual(os.path.getsize(self.file_path), 5)
+        self.assertEqual(stat.S_IMODE(os.stat(self.file_path).st_mode), 0o600)
+
+    def test_existing_file_is_truncated(self):
+        with open(self.file_path, "wb") as file:
+            file.write(b"old photo")
+        with open_private_file(self.file_path) as file:
+            file.write(b"new")
+        with open(self.file_path, "rb") as file:
+            self.assertEqual(file.read(), b"new")